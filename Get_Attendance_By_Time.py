@@ -12,12 +12,26 @@ Optional: --save results to a CSV/JSON file
 import argparse
 import csv
 import json
+import math
 from datetime import datetime
+from operator import itemgetter
 import re
+import sqlite3
+import sys
 from pathlib import Path
+import numpy as np
+import requests
 from web3 import Web3
 from web3.exceptions import BadFunctionCallOutput
 
+from attendance_rpc import MULTICALL3_ADDRESS, fetch_all_records, rpc_batch
+
+# optional faster JSON parser/serializer — falls back to the stdlib json module
+try:
+    import orjson
+except Exception:
+    orjson = None
+
 # Default contract/ABI/settings from the repo (adjust if you deploy a different address)
 DEFAULT_RPC = "http://127.0.0.1:7545"
 DEFAULT_CONTRACT_ADDRESS = "0xF00FbA609da21a13d3afb8682afe8A181bF3EA15"
@@ -25,73 +39,183 @@ DEFAULT_ABI_PATH = "AttendanceABI.json"
 
 # timestamp format used by the app
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# same format as a regex, so the hot loop can build datetimes without strptime
+TIMESTAMP_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})")
+TIMESTAMP_LEN = 19
+EPOCH = datetime(1970, 1, 1)
+# Below this many records, importing numba and loading the compiled filter costs more
+# than the NumPy path it replaces.
+JIT_MIN_ROWS = 100_000
+
+# emitted by logAttendance in attendance.sol; older deployments don't emit it
+ATTENDANCE_EVENT_NAME = "AttendanceLogged"
+ATTENDANCE_EVENT_TOPIC = Web3.keccak(text="AttendanceLogged(uint256)")
+
+# on-disk block cache (timestamps and per-block record counts); only blocks deeper than REORG_DEPTH are persisted
+BLOCK_CACHE_PATH = Path.home() / ".cache" / "attendance_blocks.sqlite"
+REORG_DEPTH = 12
 
 
 def load_abi(path: str):
+    if orjson is not None:
+        return orjson.loads(Path(path).read_bytes())
     with open(path, "r") as f:
         return json.load(f)
 
 
 def parse_time(txt: str) -> datetime:
-    # Accept date-only or date+time
+    # Accept date-only or date+time; fromisoformat is much faster than strptime
     try:
-        return datetime.strptime(txt, DATETIME_FORMAT)
+        dt = datetime.fromisoformat(txt)
     except ValueError:
+        # date only (fromisoformat before Python 3.11 doesn't take every form)
+        return datetime.strptime(txt, "%Y-%m-%d")
+    if dt.tzinfo is not None:
+        # record timestamps are naive local time
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+
+def parse_record_time(timestamp_str):
+    """Parse a record's timestamp string; search() also finds a timestamp embedded in other text.
+
+    Returns None if no valid timestamp is found.
+    """
+    ts_text = str(timestamp_str)
+    # Fast path for the app's own "YYYY-MM-DD HH:MM:SS" strings
+    if len(ts_text) == TIMESTAMP_LEN and ts_text[10] == " ":
         try:
-            # try date only
-            return datetime.strptime(txt, "%Y-%m-%d")
+            dt = datetime.fromisoformat(ts_text)
         except ValueError:
-            raise
+            dt = None
+        # fromisoformat also takes 19-char strings with an offset, e.g. "2025-12-01 20:19+01";
+        # those aren't the app's format, so leave them to the regex like before
+        if dt is not None and dt.tzinfo is None:
+            return dt
+    m = TIMESTAMP_RE.match(ts_text) or TIMESTAMP_RE.search(ts_text)
+    if not m:
+        return None
+    try:
+        return datetime(*map(int, m.groups()))
+    except ValueError:
+        # well-formed but impossible date, e.g. month 13
+        return None
+
+
+def load_filter_kernel():
+    """Return timestamp_kernels.filter_ts, importing numba on first use; None without numba."""
+    try:
+        from timestamp_kernels import filter_ts
+    except Exception:
+        return None
+    return filter_ts
+
+
+def jit_filter_rows(filter_ts, rows, start_dt: datetime, end_dt: datetime):
+    """Run filter_ts over the timestamp strings of (index, name, timestamp, hash) rows."""
+    packed = b"".join(str(r[2]).encode("utf-8")[:TIMESTAMP_LEN].ljust(TIMESTAMP_LEN, b"\0") for r in rows)
+    buf = np.frombuffer(packed, dtype=np.uint8).reshape(len(rows), TIMESTAMP_LEN)
+    # records have whole-second times, so round the bounds inward
+    start_s = math.ceil((start_dt - EPOCH).total_seconds())
+    end_s = math.floor((end_dt - EPOCH).total_seconds())
+    out_mask = np.empty(len(rows), dtype=np.int8)
+    filter_ts(buf, start_s, end_s, out_mask)
+    return out_mask
+
+
+def fetch_contract_info(w3: Web3, rpc_url: str, contract):
+    """Read chain id, contract code, totalRecords() and the genesis hash in one round-trip.
+
+    Returns (chain_id, code, total, genesis_hash); each is None if its call failed.
+    """
+    chain_reply, code_reply, total_reply, genesis_reply = rpc_batch(rpc_url, [
+        ("eth_chainId", []),
+        ("eth_getCode", [contract.address, "latest"]),
+        ("eth_call", [{"to": contract.address, "data": contract.encode_abi("totalRecords")}, "latest"]),
+        ("eth_getBlockByNumber", ["0x0", False]),
+    ])
+
+    chain_id = int(chain_reply["result"], 16) if chain_reply.get("result") else None
+    code = bytes.fromhex(code_reply["result"][2:]) if code_reply.get("result") else None
+    total = None
+    if total_reply.get("result"):
+        try:
+            total = w3.codec.decode(["uint256"], bytes.fromhex(total_reply["result"][2:]))[0]
+        except Exception:
+            total = None
+    genesis_hash = (genesis_reply.get("result") or {}).get("hash")
+    return chain_id, code, total, genesis_hash
 
 
-def collect_records(w3: Web3, contract, start_dt: datetime, end_dt: datetime, debug: bool = False, include_invalid: bool = False, block_time_map: dict = None):
+def collect_records(w3: Web3, contract, start_dt: datetime, end_dt: datetime, debug: bool = False, include_invalid: bool = False, block_time_map: dict = None, multicall_addr: str = MULTICALL3_ADDRESS, rpc_url: str = None, total: int = None, quiet: bool = False):
     """Collect valid records between start_dt and end_dt.
 
+    Pass total if totalRecords() was already read, to skip fetching it again.
+    quiet suppresses the per-record warnings (fetch errors, unparseable timestamps).
     Returns a tuple: (valid_records_list, invalid_records_list)
     """
     records = []
     invalid_records = []
-    total = contract.functions.totalRecords().call()
-
-    for i in range(total):
-        try:
-            raw = contract.functions.getRecord(i).call()
-        except Exception as e:
-            print(f"⚠ Error fetching record {i}: {e}")
+    # (index, name, timestamp_str, hash) for every record fetched with the expected shape
+    rows = []
+    # (index, name, timestamp_str, hash, rec_dt) for rows parsed in Python
+    parsed = []
+    if total is None:
+        total = contract.functions.totalRecords().call()
+
+    raws = fetch_all_records(w3, contract, total, multicall_addr=multicall_addr, rpc_url=rpc_url, debug=debug)
+
+    # Per-record messages are collected and written once at the end rather than
+    # printed (and flushed) one by one; quiet drops them altogether.
+    log = []
+
+    for i, raw in enumerate(raws):
+        if raw is None:
+            log.append(f"⚠ Error fetching record {i}: batched call failed")
+            continue
+        if isinstance(raw, Exception):
+            log.append(f"⚠ Error fetching record {i}: {raw}")
             continue
 
         if debug:
-            print(f"DEBUG: raw record {i}: {repr(raw)} (types: {[type(x) for x in raw]})")
+            log.append(f"DEBUG: raw record {i}: {repr(raw)} (types: {[type(x) for x in raw]})")
 
         try:
             name, timestamp_str, hash_value = raw
         except Exception as e:
-            print(f"⚠ Unexpected record shape for {i}: {repr(raw)} -> {e}")
+            log.append(f"⚠ Unexpected record shape for {i}: {repr(raw)} -> {e}")
             if include_invalid:
                 # include it as invalid if requested
                 invalid_records.append({"index": i, "name": None, "timestamp": None, "hash": None, "raw": raw})
             continue
 
-        # Parse the timestamp string. If unable to parse, try regex fallback.
-        rec_dt = None
-        try:
-            rec_dt = datetime.strptime(timestamp_str, DATETIME_FORMAT)
-        except Exception:
-            m = re.search(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}", str(timestamp_str))
-            if m:
-                try:
-                    rec_dt = datetime.strptime(m.group(0), DATETIME_FORMAT)
-                except Exception:
-                    rec_dt = None
+        # the hash is stored as bytes32; shown as the same hex string the apps print
+        rows.append((i, name, timestamp_str, hash_value.hex()))
+
+    # For large queries with numba installed, plain timestamps are parsed and range-checked
+    # by the compiled kernel; only the rows it rejects go through the Python parser below.
+    # Block times override the stored strings, so that case always takes the Python path.
+    filter_ts = load_filter_kernel() if len(rows) >= JIT_MIN_ROWS and not block_time_map else None
+    use_jit = filter_ts is not None
+    if use_jit:
+        status = jit_filter_rows(filter_ts, rows, start_dt, end_dt)
+        records = [
+            {"index": rows[j][0], "name": rows[j][1], "timestamp": rows[j][2], "hash": rows[j][3]}
+            for j in np.nonzero(status == 1)[0]
+        ]
+        rows = [rows[j] for j in np.nonzero(status == -1)[0]]
+
+    for i, name, timestamp_str, hash_value in rows:
+        rec_dt = parse_record_time(timestamp_str)
 
         # If block_time_map is provided and contains an entry for this index, use it as authoritative
         if block_time_map and i in block_time_map:
             rec_dt = block_time_map[i]
 
         if rec_dt is None:
-            print(f"⚠ Skipping record {i} (timestamp parse error): {repr(timestamp_str)}")
+            log.append(f"⚠ Skipping record {i} (timestamp parse error): {repr(timestamp_str)}")
             if debug:
-                print(f"DEBUG: full record {i}: name={repr(name)}, ts={repr(timestamp_str)}, hash={repr(hash_value)}")
+                log.append(f"DEBUG: full record {i}: name={repr(name)}, ts={repr(timestamp_str)}, hash={repr(hash_value)}")
             if include_invalid:
                 invalid_records.append({
                     "index": i,
@@ -101,27 +225,176 @@ def collect_records(w3: Web3, contract, start_dt: datetime, end_dt: datetime, de
                 })
             continue
 
-        if start_dt <= rec_dt <= end_dt:
-            records.append({
-                "index": i,
-                "name": name,
-                "timestamp": timestamp_str,
-                "hash": hash_value,
-            })
+        parsed.append((i, name, timestamp_str, hash_value, rec_dt))
+
+    # Range-filter every parsed record at once instead of comparing row by row
+    if parsed:
+        ts_arr = np.array([p[4] for p in parsed], dtype="datetime64[us]")
+        mask = (ts_arr >= np.datetime64(start_dt, "us")) & (ts_arr <= np.datetime64(end_dt, "us"))
+        records.extend(
+            {"index": parsed[j][0], "name": parsed[j][1], "timestamp": parsed[j][2], "hash": parsed[j][3]}
+            for j in np.nonzero(mask)[0]
+        )
+        if use_jit:
+            records.sort(key=itemgetter("index"))
+
+    if log and not quiet:
+        sys.stdout.write("\n".join(log) + "\n")
 
     return records, invalid_records
 
 
+def has_event(abi, name: str) -> bool:
+    return any(item.get("type") == "event" and item.get("name") == name for item in abi)
+
+
+def block_cache_key(chain_id: int, genesis_hash: str) -> str:
+    # Ganache reuses chain id 1337 across restarts, so the genesis hash tells chains apart
+    return f"{chain_id}:{genesis_hash}"
+
+
+def empty_block_cache() -> dict:
+    """Per-block data read while mapping records to block times.
+
+    "times" holds {block: unix_timestamp} for the chain. "records" holds {block: n}, the
+    number of attendance records the contract wrote in that block, so a repeat block scan
+    only fetches blocks it hasn't seen.
+    """
+    return {"times": {}, "records": {}}
+
+
+BLOCK_CACHE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS block_times (chain TEXT, block INTEGER, ts INTEGER, PRIMARY KEY (chain, block))",
+    "CREATE TABLE IF NOT EXISTS block_records (chain TEXT, contract TEXT, block INTEGER, records INTEGER, PRIMARY KEY (chain, contract, block))",
+)
+
+
+def load_block_cache(chain_key: str, contract_address: str, path: Path = BLOCK_CACHE_PATH) -> dict:
+    """Return the block timestamps and per-block record counts stored for chain_key."""
+    if not path.exists():
+        return empty_block_cache()
+    conn = sqlite3.connect(str(path))
+    try:
+        for stmt in BLOCK_CACHE_SCHEMA:
+            conn.execute(stmt)
+        times = conn.execute("SELECT block, ts FROM block_times WHERE chain = ?", (chain_key,)).fetchall()
+        records = conn.execute(
+            "SELECT block, records FROM block_records WHERE chain = ? AND contract = ?", (chain_key, contract_address)
+        ).fetchall()
+    finally:
+        conn.close()
+    return {"times": dict(times), "records": dict(records)}
+
+
+def save_block_cache(chain_key: str, contract_address: str, cache: dict, safe_block: int, path: Path = BLOCK_CACHE_PATH):
+    """Persist cached blocks up to safe_block; newer blocks could still be reorged away."""
+    times = [(chain_key, b, ts) for b, ts in cache["times"].items() if b <= safe_block]
+    records = [(chain_key, contract_address, b, n) for b, n in cache["records"].items() if b <= safe_block]
+    if not times and not records:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    try:
+        with conn:
+            for stmt in BLOCK_CACHE_SCHEMA:
+                conn.execute(stmt)
+            conn.executemany("INSERT OR REPLACE INTO block_times (chain, block, ts) VALUES (?, ?, ?)", times)
+            conn.executemany("INSERT OR REPLACE INTO block_records (chain, contract, block, records) VALUES (?, ?, ?, ?)", records)
+    finally:
+        conn.close()
+
+
+def get_block_timestamp(w3: Web3, block_number: int, cache: dict = None) -> int:
+    if cache is not None and block_number in cache["times"]:
+        return cache["times"][block_number]
+    ts = w3.eth.get_block(block_number, full_transactions=False).timestamp
+    if cache is not None:
+        cache["times"][block_number] = ts
+    return ts
+
+
+def event_block_time_map(w3: Web3, contract_address: str, from_block: int, to_block: int, block_cache: dict = None) -> dict:
+    """Map record index -> block datetime from AttendanceLogged logs with a single eth_getLogs.
+
+    The record index is the event's indexed topic, so the mapping doesn't depend on scan order.
+    """
+    logs = w3.eth.get_logs({
+        "address": contract_address,
+        "fromBlock": from_block,
+        "toBlock": to_block,
+        "topics": [ATTENDANCE_EVENT_TOPIC],
+    })
+
+    block_times = {}
+    for blk in sorted({log["blockNumber"] for log in logs}):
+        block_times[blk] = datetime.fromtimestamp(get_block_timestamp(w3, blk, block_cache))
+
+    block_time_map = {}
+    for log in sorted(logs, key=lambda l: (l["blockNumber"], l["logIndex"])):
+        index = int.from_bytes(bytes(log["topics"][1]), "big")
+        block_time_map[index] = block_times[log["blockNumber"]]
+    return block_time_map
+
+
+def count_block_records(contract, block) -> int:
+    """Number of attendance records the contract's transactions in block wrote."""
+    count = 0
+    for tx in block.transactions:
+        # Some transactions may have 'to' as None or not be to the contract
+        if not tx.to:
+            continue
+        if Web3.to_checksum_address(tx.to) != contract.address:
+            continue
+        # Try to decode the function input using ABI
+        try:
+            fn, args_decoded = contract.decode_function_input(tx.input)
+        except Exception:
+            continue
+        if fn.fn_name == 'logAttendance':
+            count += 1
+        elif fn.fn_name == 'logAttendanceBatch':
+            count += len(args_decoded["_names"])
+    return count
+
+
+def scan_block_time_map(w3: Web3, contract, from_block: int, to_block: int, block_cache: dict = None) -> dict:
+    """Map record index -> block datetime by walking every block for logAttendance transactions.
+
+    Indexes follow transaction order, so from_block should cover the contract's first record.
+    Blocks whose record count is already cached are not fetched again.
+    """
+    cache = block_cache if block_cache is not None else empty_block_cache()
+    times, records = cache["times"], cache["records"]
+    block_time_map = {}
+    current_index = 0
+    for b in range(from_block, to_block + 1):
+        if b in records and b in times:
+            count, ts = records[b], times[b]
+        else:
+            block = w3.eth.get_block(b, full_transactions=True)
+            count, ts = count_block_records(contract, block), block.timestamp
+            records[b], times[b] = count, ts
+        if count:
+            block_dt = datetime.fromtimestamp(ts)
+            for index in range(current_index, current_index + count):
+                block_time_map[index] = block_dt
+            current_index += count
+    return block_time_map
+
+
 def save_to_csv(records, path: str):
     keys = ["index", "name", "timestamp", "hash"]
+    row = itemgetter(*keys)
     with open(path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=keys)
-        writer.writeheader()
-        for r in records:
-            writer.writerow(r)
+        writer = csv.writer(f)
+        writer.writerow(keys)
+        writer.writerows(map(row, records))
 
 
 def save_to_json(records, path: str):
+    if orjson is not None:
+        Path(path).write_bytes(orjson.dumps(records, option=orjson.OPT_INDENT_2))
+        return
     with open(path, "w", encoding="utf-8") as f:
         json.dump(records, f, indent=2, ensure_ascii=False)
 
@@ -136,13 +409,17 @@ def main():
     parser.add_argument("--rpc", default=DEFAULT_RPC, help="Web3 RPC URL (default: Ganache HTTP)")
     parser.add_argument("--contract", default=DEFAULT_CONTRACT_ADDRESS, help="Contract address (default value from repo)")
     parser.add_argument("--abi", default=DEFAULT_ABI_PATH, help="Path to ABI JSON file")
+    parser.add_argument("--multicall", default=MULTICALL3_ADDRESS, help="Multicall3 contract address used to batch getRecord calls (falls back to per-record calls if not deployed)")
 
     parser.add_argument("--save", help="Save results to file (CSV or JSON by extension) e.g., out.csv or out.json")
     parser.add_argument("--debug", action="store_true", help="Print raw values from the contract for debugging")
+    parser.add_argument("--quiet", action="store_true", help="Don't print per-record warnings (fetch errors, unparseable timestamps)")
+    parser.add_argument("--check", action="store_true", help="Check the RPC connection (web3_clientVersion) before doing anything else")
     parser.add_argument("--include-invalid", action="store_true", help="Include records with invalid/unparseable timestamp in the output (printed separately)")
     parser.add_argument("--use-block-times", action="store_true", help="Use block timestamps for logAttendance transactions (fallback or authoritative time)")
     parser.add_argument("--from-block", type=int, default=0, help="Start block to scan for logAttendance transactions (when using --use-block-times)")
     parser.add_argument("--to-block", default="latest", help="End block to scan (int or 'latest'); used with --use-block-times")
+    parser.add_argument("--no-block-cache", action="store_true", help=f"Don't read or write the block cache ({BLOCK_CACHE_PATH})")
 
     args = parser.parse_args()
 
@@ -169,9 +446,10 @@ def main():
     if end_dt < start_dt:
         parser.error("--end cannot be earlier than --start")
 
-    # Connect web3
+    # Connect web3. is_connected() costs an extra round-trip, so by default an unreachable
+    # node is detected by the first real request below instead.
     w3 = Web3(Web3.HTTPProvider(args.rpc))
-    if not w3.is_connected():
+    if args.check and not w3.is_connected():
         print("❌ Web3 not connected. Check your RPC URL (Ganache).")
         return
 
@@ -185,28 +463,47 @@ def main():
     checksum_address = Web3.to_checksum_address(args.contract)
     contract = w3.eth.contract(address=checksum_address, abi=abi)
 
-    # Diagnostic checks to help debug contract issues
+    # Diagnostic checks to help debug contract issues. Chain id, contract code, totalRecords
+    # and the genesis hash (block cache key) go out as one JSON-RPC batch; anything it
+    # couldn't read is retried singly.
+    chain_id = code = total_onchain = genesis_hash = None
     try:
-        chain_id = w3.eth.chain_id
+        chain_id, code, total_onchain, genesis_hash = fetch_contract_info(w3, args.rpc, contract)
+    except requests.exceptions.ConnectionError:
+        print("❌ Web3 not connected. Check your RPC URL (Ganache).")
+        return
+    except Exception as e:
+        if args.debug:
+            print(f"DEBUG: batched diagnostics failed, using individual calls: {e}")
+
+    if chain_id is None:
+        try:
+            chain_id = w3.eth.chain_id
+        except Exception:
+            pass
+    if chain_id is not None:
         print(f"Connected to chain id: {chain_id}")
-    except Exception:
+    else:
         print("⚠ Could not query chain id — check your RPC provider.")
 
-    try:
-        code = w3.eth.get_code(checksum_address)
-        if not code or code in (b"", b"0x"):
-            print(f"❌ No contract code found at {checksum_address}. Is the contract deployed to this chain?")
-            return
-    except Exception as e:
-        print(f"⚠ Could not get code for contract address {checksum_address}: {e}")
-        # proceed — the subsequent call will likely fail but we still attempt it for clearer error
+    if code is None:
+        try:
+            code = w3.eth.get_code(checksum_address)
+        except Exception as e:
+            print(f"⚠ Could not get code for contract address {checksum_address}: {e}")
+            # proceed — the subsequent call will likely fail but we still attempt it for clearer error
+    if code is not None and code in (b"", b"0x"):
+        print(f"❌ No contract code found at {checksum_address}. Is the contract deployed to this chain?")
+        return
 
     # Print total records (diagnostic)
-    try:
-        total_onchain = contract.functions.totalRecords().call()
+    if total_onchain is None:
+        try:
+            total_onchain = contract.functions.totalRecords().call()
+        except Exception as e:
+            print(f"⚠ Could not read totalRecords(): {e}")
+    if total_onchain is not None:
         print(f"On-chain totalRecords: {total_onchain}")
-    except Exception as e:
-        print(f"⚠ Could not read totalRecords(): {e}")
 
     # If the user asked to use block timestamps, build a mapping of tx order to block datetime
     block_time_map = None
@@ -214,37 +511,48 @@ def main():
         # Build mapping of record index -> block datetime using logAttendance transactions chronological order
         try:
             from_block = args.from_block
+            latest_block = w3.eth.block_number
             to_block = args.to_block
             if to_block == "latest":
-                to_block = w3.eth.block_number
+                to_block = latest_block
+
+            chain_key = None
+            block_cache = empty_block_cache()
+            if not args.no_block_cache:
+                try:
+                    if genesis_hash is None:
+                        genesis_hash = Web3.to_hex(w3.eth.get_block(0, full_transactions=False).hash)
+                    if chain_id is None:
+                        chain_id = w3.eth.chain_id
+                    chain_key = block_cache_key(chain_id, genesis_hash)
+                    block_cache = load_block_cache(chain_key, checksum_address)
+                except Exception as e:
+                    print(f"⚠ Could not load block cache: {e}")
 
-            print(f"Scanning blocks {from_block}..{to_block} for logAttendance transactions (this may take a while)...")
             block_time_map = {}
-            current_index = 0
-            for b in range(from_block, int(to_block) + 1):
-                block = w3.eth.get_block(b, full_transactions=True)
-                for tx in block.transactions:
-                    # Some transactions may have 'to' as None or not be to the contract
-                    if not tx.to:
-                        continue
-                    if Web3.to_checksum_address(tx.to) != checksum_address:
-                        continue
-                    # Try to decode the function input using ABI
-                    try:
-                        fn, args_decoded = contract.decode_function_input(tx.input)
-                    except Exception:
-                        continue
-                    if fn.fn_name == 'logAttendance':
-                        block_time_map[current_index] = datetime.fromtimestamp(block.timestamp)
-                        current_index += 1
+            if has_event(abi, ATTENDANCE_EVENT_NAME):
+                print(f"Fetching {ATTENDANCE_EVENT_NAME} logs for blocks {from_block}..{to_block}...")
+                block_time_map = event_block_time_map(w3, checksum_address, from_block, int(to_block), block_cache=block_cache)
+                if not block_time_map:
+                    print("No events found (contract may predate the event); falling back to block scan.")
+
+            if not block_time_map:
+                print(f"Scanning blocks {from_block}..{to_block} for logAttendance transactions (this may take a while)...")
+                block_time_map = scan_block_time_map(w3, contract, from_block, int(to_block), block_cache=block_cache)
             print(f"Found {len(block_time_map)} logAttendance transactions.")
+
+            if chain_key is not None:
+                try:
+                    save_block_cache(chain_key, checksum_address, block_cache, safe_block=latest_block - REORG_DEPTH)
+                except Exception as e:
+                    print(f"⚠ Could not save block cache: {e}")
         except Exception as e:
             print(f"⚠ Could not build block time mapping: {e}")
             block_time_map = None
 
     # Collect records in range
     try:
-        results, invalid_records = collect_records(w3, contract, start_dt, end_dt, debug=args.debug, include_invalid=args.include_invalid, block_time_map=block_time_map)
+        results, invalid_records = collect_records(w3, contract, start_dt, end_dt, debug=args.debug, include_invalid=args.include_invalid, block_time_map=block_time_map, multicall_addr=args.multicall, rpc_url=args.rpc, total=total_onchain, quiet=args.quiet)
     except BadFunctionCallOutput as e:
         print("❌ Could not call contract function — BadFunctionCallOutput (ABI mismatch or contract not deployed).")
         print("👉 Check: correct contract address, correct ABI JSON, and that Ganache is running on the provided RPC URL.")
@@ -262,15 +570,16 @@ def main():
             else:
                 print(f"Note: {len(invalid_records)} record(s) exist with invalid timestamps. Use --include-invalid to print them.")
     else:
-        # Print results
-        print(f"\n📌 Attendance records between {start_dt} and {end_dt}:\n")
+        # Print results (built up and written once; one print per line is slow on big ranges)
+        out = [f"\n📌 Attendance records between {start_dt} and {end_dt}:\n"]
         for r in results:
-            print(f"--- Record {r['index']} ---")
-            print(f"👤 Name: {r['name']}")
-            print(f"⏰ Time: {r['timestamp']}")
+            out.append(f"--- Record {r['index']} ---")
+            out.append(f"👤 Name: {r['name']}")
+            out.append(f"⏰ Time: {r['timestamp']}")
             if block_time_map and r['index'] in block_time_map:
-                print(f"⏱ Block Time: {block_time_map[r['index']].strftime('%Y-%m-%d %H:%M:%S')}")
-            print(f"🔐 Hash: {r['hash']}\n")
+                out.append(f"⏱ Block Time: {block_time_map[r['index']].strftime('%Y-%m-%d %H:%M:%S')}")
+            out.append(f"🔐 Hash: {r['hash']}\n")
+        sys.stdout.write("\n".join(out) + "\n")
 
     # If there were invalid records and user asked to include them, print them now
     if args.include_invalid and invalid_records:
@@ -1,34 +1,77 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 from insightface.app import FaceAnalysis
-import json
+from insightface.app.common import Face
+from insightface.utils import face_align
+import numpy as np
 import os
 from pathlib import Path
+import sys
 
 
 EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp']
+# str.endswith takes a tuple, so the extension check stays in C
+EXTENSIONS_TUPLE = tuple(EXTENSIONS)
 
-app = FaceAnalysis(name='buffalo_l')  # Use 'CPUExecutionProvider' if no GPU
-app.prepare(ctx_id=0, det_size=(640, 640))
+# images per batched recognition call in --bulk mode
+BULK_BATCH_SIZE = 32
+
+# every worker process holds its own copy of the models, so keep the default pool small
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+# buffalo_l's detection and recognition models; registration only needs the embedding,
+# so the landmark and gender/age models are never loaded
+MODEL_PACK = 'buffalo_l'
+DET_MODEL_FILE = 'det_10g.onnx'
+REC_MODEL_FILE = 'w600k_r50.onnx'
+DET_SIZE = (640, 640)
+
+# Models are loaded on first use so --help, argument errors and empty folders don't pay for them.
+# Set INSIGHTFACE_PROVIDERS (e.g. "CPUExecutionProvider" or "CUDAExecutionProvider,CPUExecutionProvider")
+# to choose the ONNX Runtime providers without editing code.
+_models = None
+
+
+def env_providers():
+    return [p.strip() for p in os.getenv('INSIGHTFACE_PROVIDERS', '').split(',') if p.strip()]
+
+
+def get_models():
+    """Return (detector, recognizer), loading them on first use."""
+    global _models
+    if _models is None:
+        kwargs = {}
+        providers = env_providers()
+        if providers:
+            # only pass the key when set: insightface applies its own default when it's absent,
+            # while providers=None makes multi-provider ONNX Runtime builds refuse to load
+            kwargs['providers'] = providers
+        app = FaceAnalysis(name=MODEL_PACK, allowed_modules=['detection', 'recognition'], **kwargs)
+        app.prepare(ctx_id=0, det_size=DET_SIZE)
+        _models = (app.det_model, app.models['recognition'])
+    return _models
 
 
 def find_image_in_dir(dir_path):
-    exts = EXTENSIONS
-    for f in os.listdir(dir_path):
-        p = os.path.join(dir_path, f)
-        if os.path.isfile(p) and Path(p).suffix.lower() in exts:
-            return p
+    # scandir entries carry the file type from the directory read, so no stat per file
+    with os.scandir(dir_path) as it:
+        for de in it:
+            if de.is_file() and de.name.lower().endswith(EXTENSIONS_TUPLE):
+                return de.path
     return None
 
 
+def list_images_in_dir(dir_path):
+    with os.scandir(dir_path) as it:
+        return [Path(de.path) for de in it if de.is_file() and de.name.lower().endswith(EXTENSIONS_TUPLE)]
+
+
 def resolve_image_path(image_path):
         p = Path(image_path)
         # If p is a directory, find the first supported file
         if p.is_dir():
-            for f in p.iterdir():
-                if f.is_file() and f.suffix.lower() in EXTENSIONS:
-                    return str(f)
-            return None
+            return find_image_in_dir(p)
         # If it's a file with a known extension, accept it
         if p.is_file() and p.suffix.lower() in EXTENSIONS:
             return str(p)
@@ -58,20 +101,112 @@ def generate_embedding(image_path, save_path):
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"Image file not found: {image_path}")
 
+    save_embedding(embed_image(image_path), save_path)
+
+
+def embed_image(image_path):
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"Could not read image file at: {image_path}. Check the path and file integrity.")
 
-    faces = app.get(img)
-    if not faces:
+    det_model, rec_model = get_models()
+    bboxes, kpss = det_model.detect(img, max_num=0, metric='default')
+    if bboxes.shape[0] == 0:
         raise RuntimeError("No faces detected in provided image. Try a different photo with a clear frontal face.")
 
-    emb = faces[0].embedding.tolist()
-    # Ensure directory exists
+    # only the first face is registered, so only it goes through the recognition model
+    face = Face(bbox=bboxes[0, 0:4], kps=kpss[0] if kpss is not None else None, det_score=bboxes[0, 4])
+    return rec_model.get(img, face)
+
+
+def save_embedding(embedding, save_path, verbose=True):
+    # Raw float32 .npy: ~10x smaller than a JSON list of floats and loads without parsing
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
-    with open(save_path, 'w') as f:
-        json.dump(emb, f)
-    print(f"✅ Saved embedding to {save_path}")
+    np.save(save_path, np.asarray(embedding, dtype=np.float32))
+    if verbose:
+        print(f"✅ Saved embedding to {save_path}")
+
+
+def embedding_exists(save_path):
+    # students registered before the switch to .npy have a JSON embedding instead
+    p = Path(save_path)
+    return p.exists() or p.with_suffix('.json').exists()
+
+
+def batch_embeddings(image_paths):
+    """Embed the first detected face of each image with a single batched recognition call.
+
+    Detection still runs per image since its input depends on the image size.
+    Returns {image_path: embedding}; unreadable images and images without a face are left out.
+    """
+    det_model, rec_model = get_models()
+
+    crops = []
+    found = []
+    for path in image_paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        bboxes, kpss = det_model.detect(img, max_num=0, metric='default')
+        if bboxes.shape[0] == 0 or kpss is None:
+            continue
+        # same alignment FaceAnalysis.get() applies before the recognition model
+        crops.append(face_align.norm_crop(img, landmark=kpss[0], image_size=rec_model.input_size[0]))
+        found.append(path)
+
+    if not crops:
+        return {}
+    return dict(zip(found, rec_model.get_feat(crops)))
+
+
+def init_worker_model(intra_op_threads):
+    # Each worker process loads its models once, before taking any work, with sessions
+    # limited to a share of the cores; by default every session starts one thread per core,
+    # which oversubscribes the CPU once several workers run. The sessions are built here and
+    # handed to the model classes, since FaceAnalysis has no way to pass session options.
+    global _models
+    import onnxruntime
+    from insightface.model_zoo import ArcFaceONNX, RetinaFace
+    from insightface.utils import ensure_available
+
+    model_dir = ensure_available('models', MODEL_PACK)
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    providers = env_providers() or onnxruntime.get_available_providers()
+
+    def load(cls, filename):
+        path = os.path.join(model_dir, filename)
+        return cls(model_file=path, session=onnxruntime.InferenceSession(path, sess_options=options, providers=providers))
+
+    det_model = load(RetinaFace, DET_MODEL_FILE)
+    rec_model = load(ArcFaceONNX, REC_MODEL_FILE)
+    det_model.prepare(0, input_size=DET_SIZE, det_thresh=0.5)
+    rec_model.prepare(0)
+    _models = (det_model, rec_model)
+
+
+def embed_chunk(image_paths):
+    """Process-pool task: embed a chunk of images.
+
+    Returns [(image_path, embedding, error)], with embedding None and error set on failure.
+    Images the batched pass can't handle are retried one by one to get a specific error.
+    """
+    try:
+        embeddings = batch_embeddings(image_paths)
+    except Exception:
+        embeddings = {}
+
+    results = []
+    for path in image_paths:
+        emb = embeddings.get(path)
+        if emb is None:
+            try:
+                emb = embed_image(path)
+            except Exception as e:
+                results.append((path, None, str(e)))
+                continue
+        results.append((path, emb, None))
+    return results
 
 def main():
     parser = argparse.ArgumentParser(description="Register a student's face embedding")
@@ -79,6 +214,8 @@ def main():
     parser.add_argument('--image', '-i', help='Path to student image (file or directory containing image)')
     parser.add_argument('--bulk', action='store_true', help='Register all images in a directory (use --image PATH_TO_DIR)')
     parser.add_argument('--overwrite', action='store_true', help='Overwrite existing embedding files')
+    parser.add_argument('--quiet', '-q', action='store_true', help='In --bulk mode, only print failures and the final summary')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Worker processes for --bulk (default: {DEFAULT_WORKERS})')
     args = parser.parse_args()
 
     if args.name:
@@ -104,26 +241,73 @@ def main():
         if not folder.is_dir():
             print("Bulk mode requires a directory path in --image")
             return
-        files = [p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in EXTENSIONS]
+        files = list_images_in_dir(folder)
         if not files:
             print(f"No supported images found in {folder}")
             return
+        # Per-file messages are buffered and written in one go (per chunk below)
+        # instead of a print call per image.
+        lines = []
+        pending = []
         for f in files:
             student_name = f.stem
-            save_path = Path('student_data') / f"{student_name}_embedding.json"
-            if save_path.exists() and not args.overwrite:
-                print(f"Skipping {student_name} - embedding exists. Use --overwrite to replace.")
+            save_path = Path('student_data') / f"{student_name}_embedding.npy"
+            if embedding_exists(save_path) and not args.overwrite:
+                if not args.quiet:
+                    lines.append(f"Skipping {student_name} - embedding exists. Use --overwrite to replace.")
                 continue
-            try:
-                generate_embedding(str(f), str(save_path))
-            except Exception as e:
-                print(f"❌ Failed to generate embedding for {f.name}: {e}")
-        print("✅ Bulk registration complete.")
+            pending.append((f, save_path))
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
+
+        if not pending:
+            print("✅ Bulk registration complete: nothing to do.")
+            return
+
+        save_paths = {str(f): save_path for f, save_path in pending}
+        workers = max(1, min(args.workers, len(pending)))
+        # small enough chunks that every worker gets work, capped at the batch size
+        chunk_size = max(1, min(BULK_BATCH_SIZE, -(-len(pending) // workers)))
+        paths = list(save_paths)
+        chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+
+        if workers == 1:
+            chunk_results = map(embed_chunk, chunks)
+            executor = None
+        else:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker_model, initargs=(threads,))
+            chunk_results = executor.map(embed_chunk, chunks)
+
+        saved, failed = 0, 0
+        try:
+            for results in chunk_results:
+                lines = []
+                for path, emb, error in results:
+                    if emb is None:
+                        lines.append(f"❌ Failed to generate embedding for {Path(path).name}: {error}")
+                        failed += 1
+                        continue
+                    try:
+                        save_embedding(emb, str(save_paths[path]), verbose=False)
+                        saved += 1
+                        if not args.quiet:
+                            lines.append(f"✅ Saved embedding to {save_paths[path]}")
+                    except Exception as e:
+                        lines.append(f"❌ Failed to save embedding for {Path(path).name}: {e}")
+                        failed += 1
+                if lines:
+                    sys.stdout.write("\n".join(lines) + "\n")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        print(f"✅ Bulk registration complete: {saved} saved, {failed} failed.")
         return
 
-    save_path = f"student_data/{name}_embedding.json"
+    save_path = f"student_data/{name}_embedding.npy"
 
-    if Path(save_path).exists() and not args.overwrite:
+    if embedding_exists(save_path) and not args.overwrite:
         print(f"Embedding for '{name}' already exists at {save_path}. Use --overwrite to replace.")
         return
 
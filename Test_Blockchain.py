@@ -1,5 +1,7 @@
 from web3 import Web3
 
+from attendance_rpc import fetch_all_records
+
 # -------------------------------
 # 1. Connect to Blockchain Node
 # -------------------------------
@@ -27,7 +29,7 @@ ABI = [
         "inputs": [
             {"internalType": "string", "name": "_name", "type": "string"},
             {"internalType": "string", "name": "_timestamp", "type": "string"},
-            {"internalType": "string", "name": "_hash", "type": "string"}
+            {"internalType": "bytes32", "name": "_hash", "type": "bytes32"}
         ],
         "name": "logAttendance",
         "outputs": [],
@@ -40,7 +42,7 @@ ABI = [
         "outputs": [
             {"internalType": "string", "name": "", "type": "string"},
             {"internalType": "string", "name": "", "type": "string"},
-            {"internalType": "string", "name": "", "type": "string"}
+            {"internalType": "bytes32", "name": "", "type": "bytes32"}
         ],
         "stateMutability": "view",
         "type": "function"
@@ -51,7 +53,7 @@ ABI = [
         "outputs": [
             {"internalType": "string", "name": "name", "type": "string"},
             {"internalType": "string", "name": "timestamp", "type": "string"},
-            {"internalType": "string", "name": "hash", "type": "string"}
+            {"internalType": "bytes32", "name": "hash", "type": "bytes32"}
         ],
         "stateMutability": "view",
         "type": "function"
@@ -84,13 +86,17 @@ try:
         print("No records found.")
         exit()
 
-    for i in range(total):
-        name, timestamp, hash_value = contract.functions.getRecord(i).call()
+    # One batched fetch (Multicall3 / JSON-RPC batch) instead of a getRecord call per record
+    for i, raw in enumerate(fetch_all_records(w3, contract, total)):
+        if raw is None or isinstance(raw, Exception):
+            print(f"⚠ Could not read record {i}: {raw or 'batched call failed'}\n")
+            continue
+        name, timestamp, hash_value = raw
 
         print(f"----- RECORD {i} -----")
         print(f"👤 Name: {name}")
         print(f"⏰ Time: {timestamp}")
-        print(f"🔐 Hash: {hash_value}\n")
+        print(f"🔐 Hash: {hash_value.hex()}\n")
 
 except Exception as e:
     print("❌ Error reading from contract:", str(e))
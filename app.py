@@ -1,14 +1,24 @@
 import streamlit as st
 import cv2
 import numpy as np
-from insightface.app import FaceAnalysis
+import pandas as pd
 from datetime import datetime
-import hashlib
 import json
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
 from web3 import Web3
 from eth_account import Account
 
+from face_pipeline import (
+    FRAME_HEIGHT, FRAME_WIDTH, LOG_ATTENDANCE_GAS, attendance_digest, best_match, detect_faces,
+    embed_face, frame_changed, load_face_model, open_camera, read_json, stack_embeddings,
+    tracked_name, warm_match_kernel,
+)
+
 # -------------------------
 # Streamlit Page Config
 # -------------------------
@@ -23,90 +33,228 @@ PRIVATE_KEY = "0x1d77cbde1e28ba8aaaf6e9ff779f36822b9a39a7851654ca76efda7c89eb778
 ACCOUNT_ADDRESS = "0xA31534EC2d144C309b08BB9a51A8b6CfDCb385ec"
 CONTRACT_ADDRESS = "0xF00FbA609da21a13d3afb8682afe8A181bF3EA15"
 
-# Load ABI
-with open("AttendanceABI.json", "r") as f:
-    ABI = json.load(f)
+# Load ABI (parsed once per server, not on every rerun; treat it as read-only)
+@st.cache_resource
+def load_abi(path="AttendanceABI.json"):
+    return read_json(path)
+
 
-# Connect web3
-web3 = Web3(Web3.HTTPProvider(WEB3_PROVIDER_URI))
-contract = web3.eth.contract(
-    address=Web3.to_checksum_address(CONTRACT_ADDRESS), 
-    abi=ABI
-)
+ABI = load_abi()
+
+# Connect web3 once per server: a rerun reuses the connection pool instead of opening another
+@st.cache_resource
+def init_web3():
+    # the pool is sized for the background send threads
+    http_session = requests.Session()
+    http_session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+    http_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+    web3 = Web3(Web3.HTTPProvider(WEB3_PROVIDER_URI, session=http_session))
+    contract = web3.eth.contract(
+        address=Web3.to_checksum_address(CONTRACT_ADDRESS), 
+        abi=ABI
+    )
+    return web3, contract
+
+
+web3, contract = init_web3()
+
+# contracts deployed before logAttendanceBatch existed only take one entry per transaction
+HAS_BATCH = any(item.get("type") == "function" and item.get("name") == "logAttendanceBatch" for item in ABI)
 
 # -------------------------
 # Auto-Load All Embeddings
 # -------------------------
+EMBEDDING_FOLDER = "student_data"
+# names + normalized matrix from the last load, valid while the folder signature matches
+EMBEDDING_CACHE = os.path.join(EMBEDDING_FOLDER, "_cache.npz")
+
+
+def embedding_files(folder):
+    """Folder signature: sorted (filename, mtime_ns) of every embedding file."""
+    with os.scandir(folder) as it:
+        return tuple(sorted(
+            (de.name, de.stat().st_mtime_ns)
+            for de in it
+            if de.name.endswith("_embedding.npy") or de.name.endswith(".json")
+        ))
+
+
 def load_known_embeddings():
+    """Load all student embeddings as (names, M).
+
+    M is an (N, D) float32 matrix of L2-normalized rows, so matching a face is a
+    single matrix-vector product instead of a cosine computation per student.
+    """
+    return load_embedding_matrix(embedding_files(EMBEDDING_FOLDER))
+
+
+@st.cache_resource
+def load_embedding_matrix(files):
+    # keyed on the folder signature, so registering or removing a student is picked up on the next rerun
+    try:
+        with np.load(EMBEDDING_CACHE) as data:
+            if tuple(zip(data["files"].tolist(), data["mtimes"].tolist())) == files:
+                return data["names"].tolist(), data["M"]
+    except Exception:
+        pass  # no cache yet, or unreadable: rebuild it
+
+    names, M = build_embedding_matrix(files)
+    try:
+        np.savez(
+            EMBEDDING_CACHE, names=np.array(names, dtype=str), M=M,
+            files=np.array([f for f, _ in files], dtype=str),
+            mtimes=np.array([m for _, m in files], dtype=np.int64),
+        )
+    except OSError:
+        pass
+    return names, M
+
+
+def build_embedding_matrix(files):
     embeddings = {}
-    folder = "student_data"
 
-    for filename in os.listdir(folder):
-        if filename.endswith(".json"):
-            path = os.path.join(folder, filename)
+    for filename, _ in files:
+        path = os.path.join(EMBEDDING_FOLDER, filename)
+
+        if filename.endswith("_embedding.npy"):
+            embeddings[filename.replace("_embedding.npy", "")] = np.load(path)
 
+        elif filename.endswith(".json"):
             # Extract student name from filename
             student_name = filename.replace("_embedding.json", "")
 
-            with open(path, 'r') as f:
-                data = json.load(f)
+            data = read_json(path)
 
-            embeddings[student_name] = data
+            # legacy JSON embeddings only count when the student has no .npy
+            embeddings.setdefault(student_name, data)
 
-    return embeddings
+    return stack_embeddings(embeddings)
 
 
 # -------------------------
-# Compare Face Embeddings
+# Match Face to Student
 # -------------------------
-def compare_embeddings(emb1, emb2):
-    emb1 = np.array(emb1)
-    emb2 = np.array(emb2)
-    return np.dot(emb1, emb2) / (np.linalg.norm(emb1)*np.linalg.norm(emb2))
+MATCH_THRESHOLD = 0.50   # cosine similarity
 
 
-# -------------------------
-# Match Face to Student
-# -------------------------
-def match_face(face_embedding, known_embeddings):
-    for name, known_emb in known_embeddings.items():
-        if compare_embeddings(face_embedding, known_emb) > 0.50:   # threshold
-            return name
-    return None
+def match_face(face_embedding, known_names, known_matrix):
+    # face_embedding must already be L2-normalized float32 (see embed_face)
+    if not known_names:
+        return None
+
+    i, score = best_match(known_matrix, face_embedding)
+    return known_names[i] if score > MATCH_THRESHOLD else None
 
 
 # -------------------------
 # Save Attendance to Blockchain
 # -------------------------
-def save_to_blockchain(name, timestamp):
-    hash_str = hashlib.sha256(f"{name}-{timestamp}".encode()).hexdigest()
+@st.cache_resource
+def tx_executor():
+    # sends run here so the webcam loop never waits on the node
+    return ThreadPoolExecutor(max_workers=4)
+
+
+@st.cache_resource
+def nonce_counter():
+    # Only this app sends from ACCOUNT_ADDRESS, so the nonce is counted locally and fetched
+    # from the node just once. "next" is None until then, and again after a failed send.
+    return {"lock": threading.Lock(), "next": None}
 
+
+def take_nonce(counter):
+    with counter["lock"]:
+        if counter["next"] is None:
+            counter["next"] = web3.eth.get_transaction_count(ACCOUNT_ADDRESS, 'pending')
+        nonce = counter["next"]
+        counter["next"] += 1
+        return nonce
+
+
+def reset_nonce(counter):
+    # the nonce may not have been used; resync from the node on the next send
+    with counter["lock"]:
+        counter["next"] = None
+
+
+def submit_to_blockchain(sender, entry, counter):
+    # flagged until the send finishes, so "Commit session to chain" doesn't log it a second time
+    entry["sending"] = True
+    sender.submit(save_to_blockchain, entry, counter)
+
+
+def save_to_blockchain(entry, counter):
+    """Sign and submit logAttendance for a session entry; runs on the tx_executor() pool.
+
+    Doesn't wait for the receipt: the tx hash (or the error) is stored on the entry.
+    """
     try:
-        nonce = web3.eth.get_transaction_count(ACCOUNT_ADDRESS)
+        nonce = take_nonce(counter)
 
         txn = {
             'from': ACCOUNT_ADDRESS,
             'nonce': nonce,
             'gasPrice': web3.to_wei('10', 'gwei'),
-            'chainId': 1337
+            'chainId': 1337,
+            'gas': LOG_ATTENDANCE_GAS,
         }
 
-        txn['gas'] = contract.functions.logAttendance(
-            name, timestamp, hash_str
-        ).estimate_gas(txn)
-
         txn = contract.functions.logAttendance(
-            name, timestamp, hash_str
+            entry["name"], entry["timestamp"], entry["digest"]
         ).build_transaction(txn)
 
         signed_txn = Account.sign_transaction(txn, private_key=PRIVATE_KEY)
-        tx_hash = web3.eth.send_raw_transaction(signed_txn.raw_transaction)
-        tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
-
-        st.success(f"✅ Saved to blockchain!\nTx Hash: {tx_receipt.transactionHash.hex()}")
+        entry["tx"] = web3.eth.send_raw_transaction(signed_txn.raw_transaction).hex()
+        entry.pop("error", None)  # from an earlier attempt
 
     except Exception as e:
-        st.error(f"❌ Blockchain Error: {str(e)}")
+        reset_nonce(counter)
+        entry["error"] = str(e)
+    finally:
+        entry["sending"] = False
+
+
+# Entries per logAttendanceBatch transaction: LOG_ATTENDANCE_GAS for each must stay under
+# the block gas limit (6,721,975 on Ganache), so a long session goes out in several.
+BATCH_MAX_ENTRIES = 20
+
+
+def save_batch_to_blockchain(entries, counter):
+    """Log the entries with logAttendanceBatch, BATCH_MAX_ENTRIES per transaction; return the tx hashes.
+
+    Each batch is dry-run first, so a deployment without the batch function raises here
+    instead of sending a transaction that would revert. Batches sent before an error keep
+    their tx on the entries.
+    """
+    tx_hashes = []
+    for start in range(0, len(entries), BATCH_MAX_ENTRIES):
+        chunk = entries[start:start + BATCH_MAX_ENTRIES]
+        batch = contract.functions.logAttendanceBatch(
+            [e["name"] for e in chunk],
+            [e["timestamp"] for e in chunk],
+            [e["digest"] for e in chunk],
+        )
+        batch.call({'from': ACCOUNT_ADDRESS})
+
+        nonce = take_nonce(counter)
+        try:
+            txn = batch.build_transaction({
+                'from': ACCOUNT_ADDRESS,
+                'nonce': nonce,
+                'gasPrice': web3.to_wei('10', 'gwei'),
+                'chainId': 1337,
+                'gas': LOG_ATTENDANCE_GAS * len(chunk),
+            })
+            signed_txn = Account.sign_transaction(txn, private_key=PRIVATE_KEY)
+            tx_hash = web3.eth.send_raw_transaction(signed_txn.raw_transaction).hex()
+        except Exception:
+            reset_nonce(counter)
+            raise
+
+        for e in chunk:
+            e["tx"] = tx_hash
+        tx_hashes.append(tx_hash)
+    return tx_hashes
 
 
 # -------------------------
@@ -114,13 +262,13 @@ def save_to_blockchain(name, timestamp):
 # -------------------------
 @st.cache_resource
 def init_model():
-    app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-    app.prepare(ctx_id=0, det_size=(640, 640))
-    return app
+    return load_face_model()
 
 
 app_model = init_model()
-known_embeddings = load_known_embeddings()
+rec_model = app_model.models['recognition']
+known_names, known_matrix = load_known_embeddings()
+warm_match_kernel(known_matrix)
 
 
 # -------------------------
@@ -151,91 +299,96 @@ with col2:
         st.session_state.run_webcam = False
 
 
-# -------------------------
-# Webcam Processing
-# -------------------------
-stframe = st.empty()
-
-if st.session_state.run_webcam:
-    cap = cv2.VideoCapture(0)
-
-    while st.session_state.run_webcam:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        faces = app_model.get(frame)
-
-        for face in faces:
-            embedding = face.embedding.tolist()
-            name = match_face(embedding, known_embeddings)
-
-            if name and name not in st.session_state.logged_users:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                # record locally in session_entries for dashboard and later MetaMask sending
-                hash_str = hashlib.sha256(f"{name}-{timestamp}".encode()).hexdigest()
-                entry = {"name": name, "timestamp": timestamp, "hash": hash_str, "tx": None}
-                st.session_state.session_entries.append(entry)
-                st.session_state.logged_users.add(name)
-                label = f"{name} @ {timestamp}"
-                color = (0, 255, 0)
+# on: the server signs and sends each entry with PRIVATE_KEY as soon as it is recognized.
+# off (default): entries wait for "Commit session to chain" or MetaMask, as before.
+st.checkbox("Send each entry from the server as soon as it is recognized", value=False, key="live_send")
 
-            elif name:
-                label = f"{name} (Already Logged)"
-                color = (100, 255, 100)
 
-            else:
-                label = "Unknown"
-                color = (0, 0, 255)
-
-            x1, y1, x2, y2 = map(int, face.bbox)
-            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-            cv2.putText(frame, label, (x1, y1 - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        stframe.image(frame, channels="RGB")
-
-    cap.release()
-    stframe.empty()
-
-    # Show session dashboard when webcam stops
+# -------------------------
+# Session Dashboard
+# -------------------------
+# A fragment: its buttons rerun only this section, not the webcam loop below.
+@st.fragment
+def session_dashboard():
     if st.session_state.session_entries:
         st.markdown("---")
         st.markdown("## Session Attendance Dashboard")
-        # Show a simple table
-        df_rows = [ {"Name": e["name"], "Timestamp": e["timestamp"], "Hash": e["hash"], "Tx": e.get("tx", "")} for e in st.session_state.session_entries ]
-        st.table(df_rows)
+        # st.dataframe renders virtualized on the client, unlike st.table
+        df = pd.DataFrame(st.session_state.session_entries, columns=["name", "timestamp", "hash", "tx", "error"])
+        df.columns = ["Name", "Timestamp", "Hash", "Tx", "Error"]
+        st.dataframe(df, use_container_width=True)
+
+        # entries still being sent live are left out, or they would be logged twice
+        pending = [e for e in st.session_state.session_entries if not e.get("tx") and not e.get("sending")]
+        if pending and st.button(f"⛓️ Commit session to chain ({len(pending)} entries)"):
+            try:
+                if not HAS_BATCH:
+                    raise ValueError("contract ABI has no logAttendanceBatch")
+                tx_hashes = save_batch_to_blockchain(pending, nonce_counter())
+                st.success(f"✅ Sent {len(pending)} entries in {len(tx_hashes)} transaction(s)!\nTx Hashes: {', '.join(tx_hashes)}")
+            except Exception as e:
+                st.warning(f"Batch send not available ({e}); sending entries one by one")
+                sender, counter = tx_executor(), nonce_counter()
+                for entry in pending:
+                    if not entry.get("tx"):
+                        submit_to_blockchain(sender, entry, counter)
 
         # Allow user to send per-entry via MetaMask
         st.markdown("---")
         st.markdown("### Send entries via MetaMask")
 
-        abi_text = json.dumps(ABI)
+        # only logAttendance is called from the page, so only its ABI entry is embedded
+        abi_text = json.dumps([item for item in ABI if item.get("name") == "logAttendance"])
         contract_address = CONTRACT_ADDRESS
 
-        for i, entry in enumerate(st.session_state.session_entries):
-            st.write(f"**{entry['name']}** — {entry['timestamp']} — {entry['hash']}")
+        unsent = []
+        for entry in st.session_state.session_entries:
             if entry.get('tx'):
+                st.write(f"**{entry['name']}** — {entry['timestamp']} — {entry['hash']}")
                 st.success(f"Already sent on chain — Tx: {entry['tx']}")
                 continue
-
-            # build JS content to call contract.logAttendance with Ethers.js and MetaMask
+            if entry.get('sending'):
+                st.write(f"**{entry['name']}** — {entry['timestamp']} — {entry['hash']}")
+                st.info("Being sent from the server…")
+                continue
+            unsent.append({
+                "label": f"{entry['name']} — {entry['timestamp']} — {entry['hash']}",
+                "name": entry['name'],
+                "timestamp": entry['timestamp'],
+                # ethers.js takes bytes32 as 0x-prefixed hex
+                "hash": '0x' + entry['hash'],
+            })
+
+        if unsent:
+            # one component for all entries: the ABI and ethers.js load once, and a single
+            # delegated click handler serves every button
             js_html = f"""
-            <div>
-              <button id='send_{i}'>Send via MetaMask</button>
-              <div id='status_{i}'></div>
-            </div>
+            <div id='entries'></div>
             <script src='https://cdn.jsdelivr.net/npm/ethers@5.7.2/dist/ethers.min.js'></script>
             <script>
             const abi = {abi_text};
             const contractAddress = '{contract_address}';
-            const name = {json.dumps(entry['name'])};
-            const timestamp = {json.dumps(entry['timestamp'])};
-            const hash = {json.dumps(entry['hash'])};
-
-            document.getElementById('send_{i}').onclick = async function() {{
-                const statusEl = document.getElementById('status_{i}');
+            const entries = {json.dumps(unsent)};
+            const list = document.getElementById('entries');
+
+            entries.forEach(function(entry, i) {{
+                const label = document.createElement('div');
+                label.textContent = entry.label;
+                const button = document.createElement('button');
+                button.textContent = 'Send via MetaMask';
+                button.dataset.index = i;
+                const status = document.createElement('div');
+                status.id = 'status_' + i;
+                list.append(label, button, status);
+            }});
+
+            list.addEventListener('click', async function(event) {{
+                const i = event.target.dataset.index;
+                if (i === undefined) {{
+                    return;
+                }}
+                const entry = entries[i];
+                const statusEl = document.getElementById('status_' + i);
                 if (!window.ethereum) {{
                     statusEl.innerText = 'MetaMask not found';
                     return;
@@ -246,28 +399,145 @@ if st.session_state.run_webcam:
                     const signer = provider.getSigner();
                     const contract = new ethers.Contract(contractAddress, abi, signer);
                     statusEl.innerText = 'Sending...';
-                    const tx = await contract.logAttendance(name, timestamp, hash);
+                    const tx = await contract.logAttendance(entry.name, entry.timestamp, entry.hash);
                     statusEl.innerText = 'Tx sent: ' + tx.hash + ' (waiting for confirmation)';
                     const receipt = await tx.wait();
                     statusEl.innerText = 'Mined: ' + receipt.transactionHash;
                 }} catch (err) {{
                     statusEl.innerText = 'Error: ' + err.message;
                 }}
-            }}
+            }});
             </script>
             """
 
-            st.components.v1.html(js_html, height=160)
-
-            st.markdown("---")
-            if st.button("Refresh On-Chain Records"):
-                try:
-                    total = contract.functions.totalRecords().call()
-                    records = []
-                    for idx in range(total):
-                        n, t, h = contract.functions.getRecord(idx).call()
-                        records.append({"index": idx, "name": n, "timestamp": t, "hash": h})
-                    st.write("### On-chain Records")
-                    st.table(records)
-                except Exception as e:
-                    st.error(f"Error reading on-chain records: {e}")
+            st.components.v1.html(js_html, height=40 + 80 * len(unsent), scrolling=True)
+
+        st.markdown("---")
+        if st.button("Refresh On-Chain Records"):
+            try:
+                total = contract.functions.totalRecords().call()
+                records = []
+                for idx in range(total):
+                    n, t, h = contract.functions.getRecord(idx).call()
+                    records.append({"index": idx, "name": n, "timestamp": t, "hash": h.hex()})
+                st.write("### On-chain Records")
+                st.table(records)
+            except Exception as e:
+                st.error(f"Error reading on-chain records: {e}")
+
+
+# -------------------------
+# Webcam Processing
+# -------------------------
+# Frames are read into a fixed pool of buffers instead of a new array per frame:
+# one being filled, one waiting in the queue, one being processed.
+FRAME_BUFFERS = 3
+
+# frames go to the browser as JPEG, a fraction of the raw RGB payload
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 80]
+
+
+def capture_frames(cap, frames, free, stop_event):
+    """Producer thread: keep only the newest camera frame in `frames` (a size-1 queue).
+
+    Each frame is read into a buffer taken from `free`; the consumer puts it back when done.
+    """
+    while not stop_event.is_set():
+        try:
+            buf = free.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        # cap.read fills buf in place (it only allocates if the camera ignored the size)
+        ret, frame = cap.read(buf)
+        if not ret:
+            stop_event.set()
+            break
+        # drop the stale frame rather than make inference fall behind the camera
+        try:
+            free.put(frames.get_nowait())
+        except queue.Empty:
+            pass
+        frames.put_nowait(frame)
+
+
+stframe = st.empty()
+
+if st.session_state.run_webcam:
+    cap = open_camera(0)
+    # capture runs on its own thread so cap.read() overlaps with inference below
+    frames = queue.Queue(maxsize=1)
+    free = queue.Queue()
+    for _ in range(FRAME_BUFFERS):
+        free.put(np.empty((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8))
+    stop_event = threading.Event()
+    reader = threading.Thread(target=capture_frames, args=(cap, frames, free, stop_event), daemon=True)
+    reader.start()
+    faces, ref_small = [], None
+    tracked = []
+    sender, counter = tx_executor(), nonce_counter()
+
+    try:
+        while not stop_event.is_set():
+            try:
+                frame = frames.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            # static scene: reuse the last detections instead of running the model again
+            changed, small = frame_changed(frame, ref_small)
+            if changed:
+                faces = detect_faces(app_model, frame)
+                ref_small = small
+
+            # every face is recognized before anything is drawn: the aligned crop reaches past
+            # the bbox and would otherwise pick up a neighbour's box or label
+            names = []
+            for face in faces:
+                name = tracked_name(face.bbox, tracked)
+                if name is None:
+                    name = match_face(embed_face(rec_model, frame, face), known_names, known_matrix)
+                names.append(name)
+            tracked = [(face.bbox, name) for face, name in zip(faces, names) if name]
+
+            for face, name in zip(faces, names):
+                if name and name not in st.session_state.logged_users:
+                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    # record locally in session_entries for dashboard and later MetaMask sending
+                    digest = attendance_digest(name, timestamp)
+                    entry = {"name": name, "timestamp": timestamp, "hash": digest.hex(), "digest": digest, "tx": None}
+                    st.session_state.session_entries.append(entry)
+                    st.session_state.logged_users.add(name)
+                    # sent in the background; entries left without a tx can still go via MetaMask
+                    if st.session_state.live_send:
+                        submit_to_blockchain(sender, entry, counter)
+                    label = f"{name} @ {timestamp}"
+                    color = (0, 255, 0)
+
+                elif name:
+                    label = f"{name} (Already Logged)"
+                    color = (100, 255, 100)
+
+                else:
+                    label = "Unknown"
+                    color = (0, 0, 255)
+
+                x1, y1, x2, y2 = map(int, face.bbox)
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                cv2.putText(frame, label, (x1, y1 - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+
+            # encoded straight from BGR, so no RGB copy is made either
+            ok, jpg = cv2.imencode('.jpg', frame, JPEG_PARAMS)
+            if ok:
+                stframe.image(jpg.tobytes())
+            free.put(frame)
+    finally:
+        # also runs when Streamlit interrupts the script on a rerun (e.g. Stop pressed)
+        stop_event.set()
+        reader.join()
+        cap.release()
+    stframe.empty()
+
+# Outside the webcam block: Stop interrupts the loop above and the rerun has run_webcam off,
+# so this is where the dashboard shows up once the webcam stops.
+session_dashboard()
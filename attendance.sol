@@ -5,16 +5,30 @@ contract Attendance {
     struct AttendanceRecord {
         string name;
         string timestamp;
-        string hash;
+        // raw sha256 digest: one storage slot, against three for its 64-char hex string
+        bytes32 hash;
     }
 
     AttendanceRecord[] public records;
 
-    function logAttendance(string memory _name, string memory _timestamp, string memory _hash) public {
+    // Only the record index: the data is already in storage, and repeating the strings in the log costs gas.
+    event AttendanceLogged(uint indexed index);
+
+    function logAttendance(string memory _name, string memory _timestamp, bytes32 _hash) public {
         records.push(AttendanceRecord(_name, _timestamp, _hash));
+        emit AttendanceLogged(records.length - 1);
+    }
+
+    // Log a whole session in one transaction instead of one per student.
+    function logAttendanceBatch(string[] calldata _names, string[] calldata _timestamps, bytes32[] calldata _hashes) public {
+        require(_names.length == _timestamps.length && _names.length == _hashes.length, "length mismatch");
+        for (uint i = 0; i < _names.length; i++) {
+            records.push(AttendanceRecord(_names[i], _timestamps[i], _hashes[i]));
+            emit AttendanceLogged(records.length - 1);
+        }
     }
 
-    function getRecord(uint index) public view returns (string memory, string memory, string memory) {
+    function getRecord(uint index) public view returns (string memory, string memory, bytes32) {
         AttendanceRecord memory record = records[index];
         return (record.name, record.timestamp, record.hash);
     }
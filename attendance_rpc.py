@@ -0,0 +1,216 @@
+"""
+attendance_rpc.py
+
+Shared helpers for reading attendance records from the Attendance contract with as few
+RPC round-trips as possible. Used by Get_Attendance_By_Time.py and Test_Blockchain.py.
+
+fetch_all_records() tries, in order: one Multicall3 aggregate3 call, JSON-RPC batch
+requests, concurrent calls over an async provider, and finally one eth_call per record.
+"""
+
+import asyncio
+import requests
+from eth_utils import function_abi_to_4byte_selector
+from web3 import AsyncHTTPProvider, AsyncWeb3, Web3
+
+# Multicall3 lives at the same address on most chains. A fresh Ganache usually
+# doesn't have it, in which case the other strategies below are used.
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"},
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]",
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"},
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]",
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function",
+    }
+]
+
+# getRecord(i) returns (name, timestamp, hash)
+RECORD_TYPES = ["string", "string", "bytes32"]
+
+# keep each aggregate3 eth_call well under the node's gas/response limits
+MULTICALL_BATCH_SIZE = 500
+
+# requests per JSON-RPC batch POST; large batches can hit node response-size limits
+JSONRPC_BATCH_SIZE = 500
+
+# max in-flight getRecord calls when neither Multicall3 nor batching is available
+ASYNC_CONCURRENCY = 64
+
+
+def record_calldata(w3: Web3, contract):
+    """Return a function i -> getRecord(i) calldata bytes.
+
+    The 4-byte selector is computed once, so each call only ABI-encodes the index
+    instead of building a ContractFunction.
+    """
+    selector = function_abi_to_4byte_selector(contract.get_function_by_name("getRecord").abi)
+    return lambda i: selector + w3.codec.encode(["uint256"], [i])
+
+
+def multicall_get_records(w3: Web3, contract, total: int, multicall_addr: str = MULTICALL3_ADDRESS):
+    """Fetch getRecord(0..total-1) through Multicall3 aggregate3 instead of one eth_call per record.
+
+    Returns a list with one entry per index: the decoded (name, timestamp, hash) tuple,
+    or None if that particular call failed. Returns None if Multicall3 is not deployed
+    on the connected chain, so the caller can fall back to another strategy.
+    """
+    multicall_addr = Web3.to_checksum_address(multicall_addr)
+    code = w3.eth.get_code(multicall_addr)
+    if not code or code in (b"", b"0x"):
+        return None
+
+    multicall = w3.eth.contract(address=multicall_addr, abi=MULTICALL3_ABI)
+    calldata = record_calldata(w3, contract)
+    raws = []
+    for start in range(0, total, MULTICALL_BATCH_SIZE):
+        calls = [
+            (contract.address, True, calldata(i))
+            for i in range(start, min(start + MULTICALL_BATCH_SIZE, total))
+        ]
+        for success, ret in multicall.functions.aggregate3(calls).call():
+            if not success:
+                raws.append(None)
+                continue
+            try:
+                raws.append(w3.codec.decode(RECORD_TYPES, ret))
+            except Exception:
+                raws.append(None)
+
+    return raws
+
+
+def rpc_batch(rpc_url: str, calls):
+    """POST [(method, params), ...] as a single JSON-RPC 2.0 batch.
+
+    Returns the reply objects in the same order as calls (an empty dict for any missing reply).
+    """
+    payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(calls)]
+    resp = requests.post(rpc_url, json=payload, timeout=60)
+    resp.raise_for_status()
+    replies = resp.json()
+    if not isinstance(replies, list):
+        # nodes without batch support answer with a single error object
+        raise ValueError(f"RPC endpoint rejected the batch request: {replies}")
+
+    # replies may come back in any order
+    by_id = {r.get("id"): r for r in replies}
+    return [by_id.get(i, {}) for i in range(len(calls))]
+
+
+def batch_get_records(w3: Web3, contract, total: int, rpc_url: str):
+    """Fetch getRecord(0..total-1) as JSON-RPC 2.0 batches (one HTTP POST per chunk).
+
+    Works on any node that accepts batch requests (Geth, Ganache), no extra contract needed.
+    Returns the same shape as multicall_get_records.
+    """
+    calldata = record_calldata(w3, contract)
+    raws = []
+    for start in range(0, total, JSONRPC_BATCH_SIZE):
+        calls = [
+            ("eth_call", [{"to": contract.address, "data": "0x" + calldata(i).hex()}, "latest"])
+            for i in range(start, min(start + JSONRPC_BATCH_SIZE, total))
+        ]
+        for reply in rpc_batch(rpc_url, calls):
+            result = reply.get("result")
+            if not result:
+                raws.append(None)
+                continue
+            try:
+                raws.append(w3.codec.decode(RECORD_TYPES, bytes.fromhex(result[2:])))
+            except Exception:
+                raws.append(None)
+
+    return raws
+
+
+async def async_get_records(rpc_url: str, contract, total: int, concurrency: int = ASYNC_CONCURRENCY):
+    """Fetch getRecord(0..total-1) as concurrent eth_calls over an AsyncHTTPProvider.
+
+    Returns one entry per index: the (name, timestamp, hash) tuple, or the exception
+    raised by that call.
+    """
+    aw3 = AsyncWeb3(AsyncHTTPProvider(rpc_url))
+    calldata = record_calldata(aw3, contract)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch(i):
+        async with sem:
+            ret = await aw3.eth.call({"to": contract.address, "data": calldata(i)})
+        return aw3.codec.decode(RECORD_TYPES, ret)
+
+    try:
+        return await asyncio.gather(*(fetch(i) for i in range(total)), return_exceptions=True)
+    finally:
+        await aw3.provider.disconnect()
+
+
+def sequential_get_records(w3: Web3, contract, total: int):
+    """Fetch getRecord(0..total-1) one eth_call at a time; the last-resort strategy.
+
+    Returns one entry per index: the (name, timestamp, hash) tuple, or the exception raised.
+    """
+    calldata = record_calldata(w3, contract)
+    raws = []
+    for i in range(total):
+        try:
+            raws.append(w3.codec.decode(RECORD_TYPES, w3.eth.call({"to": contract.address, "data": calldata(i)})))
+        except Exception as e:
+            raws.append(e)
+    return raws
+
+
+def fetch_all_records(w3: Web3, contract, total: int, multicall_addr: str = MULTICALL3_ADDRESS, rpc_url: str = None, debug: bool = False):
+    """Fetch getRecord(0..total-1) using the cheapest strategy the node supports.
+
+    rpc_url defaults to the HTTP provider's endpoint. Returns a list with one entry per
+    index: the (name, timestamp, hash) tuple, None if a batched call failed, or the
+    exception raised by an individual call.
+    """
+    rpc_url = rpc_url or getattr(w3.provider, "endpoint_uri", None)
+
+    # Prefer one aggregate3 call over `total` round-trips; if Multicall3 is missing,
+    # try a JSON-RPC batch, then concurrent calls, and only then one call at a time
+    raws = None
+    try:
+        raws = multicall_get_records(w3, contract, total, multicall_addr=multicall_addr)
+    except Exception as e:
+        print(f"⚠ Multicall3 fetch failed: {e}")
+    if raws is None and rpc_url:
+        try:
+            raws = batch_get_records(w3, contract, total, rpc_url)
+        except Exception as e:
+            print(f"⚠ JSON-RPC batch fetch failed, falling back to concurrent calls: {e}")
+    if raws is None and rpc_url:
+        try:
+            raws = asyncio.run(async_get_records(rpc_url, contract, total))
+        except Exception as e:
+            print(f"⚠ Concurrent fetch failed, falling back to per-record calls: {e}")
+    if raws is None:
+        if debug:
+            print(f"DEBUG: batched fetch not available; fetching {total} record(s) one by one")
+        raws = sequential_get_records(w3, contract, total)
+
+    return raws
@@ -1,18 +1,25 @@
 import argparse
+from functools import lru_cache
 import cv2
 import os
-import json
-import hashlib
 from datetime import datetime
 import numpy as np
 from pathlib import Path
 import textwrap
-from insightface.app import FaceAnalysis
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from face_pipeline import (
+    FRAME_HEIGHT, FRAME_WIDTH, LOG_ATTENDANCE_GAS, attendance_digest, best_match, detect_faces,
+    embed_face, frame_changed, load_face_model, open_camera, read_json, stack_embeddings,
+    tracked_name, warm_match_kernel,
+)
 
 # optional web3 imports — only required when user requests to send to blockchain
 try:
     from web3 import Web3
     from eth_account import Account
+    import requests
+    from requests.adapters import HTTPAdapter
 except Exception:
     Web3 = None
     Account = None
@@ -20,34 +27,55 @@ except Exception:
 # --------------------------------------
 # 1. Initialize InsightFace model
 # --------------------------------------
-app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-app.prepare(ctx_id=0, det_size=(640, 640))
+app = load_face_model()
+rec_model = app.models['recognition']
 
 # --------------------------------------
 # 2. Load all embeddings automatically
 # --------------------------------------
 STUDENT_FOLDER = "student_data"
 
-def load_all_embeddings():
-    embeddings = {}
 
+def load_all_embeddings():
+    """Load all student embeddings as (names, M), M being an (N, D) float32 matrix of unit rows."""
     if not os.path.exists(STUDENT_FOLDER):
         print(f"❌ Folder not found: {STUDENT_FOLDER}")
-        return embeddings
+        return stack_embeddings({})
 
-    for file in os.listdir(STUDENT_FOLDER):
-        if file.endswith("_embedding.json"):
-            name = file.replace("_embedding.json", "")
+    # folder signature: unchanged files reuse the matrix built last time
+    with os.scandir(STUDENT_FOLDER) as it:
+        signature = tuple(sorted((de.name, de.stat().st_mtime_ns) for de in it))
+    return load_embeddings_for(signature)
+
+
+@lru_cache(maxsize=1)
+def load_embeddings_for(signature):
+    embeddings = {}
+
+    for file, _ in signature:
+        if file.endswith("_embedding.npy"):
+            name = file.replace("_embedding.npy", "")
             path = os.path.join(STUDENT_FOLDER, file)
 
             try:
-                with open(path, "r") as f:
-                    embeddings[name] = json.load(f)
+                embeddings[name] = np.load(path)
                 print(f"✅ Loaded embedding → {name}")
             except Exception as e:
                 print(f"⚠ Could not load {file}: {e}")
 
-    return embeddings
+        elif file.endswith("_embedding.json"):
+            name = file.replace("_embedding.json", "")
+            path = os.path.join(STUDENT_FOLDER, file)
+
+            try:
+                data = read_json(path)
+                # legacy JSON embeddings only count when the student has no .npy
+                if embeddings.setdefault(name, data) is data:
+                    print(f"✅ Loaded embedding → {name}")
+            except Exception as e:
+                print(f"⚠ Could not load {file}: {e}")
+
+    return stack_embeddings(embeddings)
 
 
 # -----------------------------
@@ -70,34 +98,70 @@ DEFAULT_PRIVATE_KEY = os.getenv('PRIVATE_KEY', '0x1d77cbde1e28ba8aaaf6e9ff779f36
 
 
 # --------------------------------------
-# 3. Compare embeddings (cosine similarity)
+# 3. Match detected face with known users
 # --------------------------------------
-def compare_embeddings(e1, e2):
-    e1, e2 = np.array(e1), np.array(e2)
-    return np.dot(e1, e2) / (np.linalg.norm(e1) * np.linalg.norm(e2))
+# A score this high against a recently matched student is taken without scoring
+# everyone else; in steady state the same few faces are in front of the camera.
+HIGH_CONFIDENCE = 0.90
+RECENT_MATCHES = 8
+
+# rows of recent matches, newest first; only valid for the matrix they were taken from
+_recent = {"matrix": None, "rows": []}
+
+
+def remember_match(known_matrix, row):
+    if _recent["matrix"] is not known_matrix:
+        _recent["matrix"], _recent["rows"] = known_matrix, []
+    rows = _recent["rows"]
+    if row in rows:
+        rows.remove(row)
+    rows.insert(0, row)
+    del rows[RECENT_MATCHES:]
+
+
+def match_face(face_embedding, known_names, known_matrix, threshold=0.55):
+    # face_embedding must already be L2-normalized float32 (see embed_face)
+    if not known_names:
+        return None
+
+    p = face_embedding
+    if _recent["matrix"] is known_matrix and _recent["rows"]:
+        rows = _recent["rows"]
+        recent_sims = known_matrix[rows] @ p
+        j = int(recent_sims.argmax())
+        if recent_sims[j] > HIGH_CONFIDENCE:
+            remember_match(known_matrix, rows[j])
+            return known_names[rows[j]]
+
+    i, score = best_match(known_matrix, p)
+    if score <= threshold:
+        return None
+    remember_match(known_matrix, i)
+    return known_names[i]
 
 
 # --------------------------------------
-# 4. Match detected face with known users
+# 4. Save attendance (blockchain placeholder)
 # --------------------------------------
-def match_face(face_embedding, known_embeddings, threshold=0.55):
-    best_name = None
-    best_score = 0
+# Next nonce per sending account. Only this process sends from the account, so it is
+# counted locally instead of asking the node before every transaction; an account's
+# entry is dropped after a failed send so the next one resyncs.
+_next_nonce = {}
+_nonce_lock = threading.Lock()  # sends run on a thread pool (see capture_and_log)
 
-    for name, emb in known_embeddings.items():
-        score = compare_embeddings(face_embedding, emb)
-        if score > threshold and score > best_score:
-            best_score = score
-            best_name = name
 
-    return best_name
+def next_nonce(web3, account_address):
+    with _nonce_lock:
+        if account_address not in _next_nonce:
+            _next_nonce[account_address] = web3.eth.get_transaction_count(account_address, 'pending')
+        nonce = _next_nonce[account_address]
+        _next_nonce[account_address] = nonce + 1
+        return nonce
 
 
-# --------------------------------------
-# 5. Save attendance (blockchain placeholder)
-# --------------------------------------
-def save_to_blockchain(name, timestamp, web3=None, contract=None, account_address=None, private_key=None):
-    hash_str = hashlib.sha256(f"{name}-{timestamp}".encode()).hexdigest()
+def save_to_blockchain(name, timestamp, web3=None, contract=None, account_address=None, private_key=None, chain_id=None):
+    digest = attendance_digest(name, timestamp)
+    hash_str = digest.hex()
 
     print("\n📌 Sending to blockchain...")
     print(f"👤 Name: {name}")
@@ -106,26 +170,27 @@ def save_to_blockchain(name, timestamp, web3=None, contract=None, account_addres
     # If web3 is provided, attempt to send a real transaction
     if web3 and contract and private_key and account_address:
         try:
-            nonce = web3.eth.get_transaction_count(account_address)
+            nonce = next_nonce(web3, account_address)
 
             txn = {
                 'from': account_address,
                 'nonce': nonce,
                 'gasPrice': web3.to_wei('10', 'gwei'),
-                'chainId': web3.eth.chain_id,
+                'chainId': chain_id if chain_id is not None else web3.eth.chain_id,
+                'gas': LOG_ATTENDANCE_GAS,
             }
 
-            txn['gas'] = contract.functions.logAttendance(name, timestamp, hash_str).estimate_gas(txn)
-
-            txn = contract.functions.logAttendance(name, timestamp, hash_str).build_transaction(txn)
+            txn = contract.functions.logAttendance(name, timestamp, digest).build_transaction(txn)
 
             signed_txn = Account.sign_transaction(txn, private_key=private_key)
-            tx_hash = web3.eth.send_raw_transaction(signed_txn.raw_transaction)
-            tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
+            # submitted, not mined: waiting for the receipt would stall the webcam
+            tx_hash = web3.eth.send_raw_transaction(signed_txn.raw_transaction).hex()
 
-            print(f"✅ Sent to chain. Tx: {tx_receipt.transactionHash.hex()}")
-            return True, tx_receipt.transactionHash.hex()
+            print(f"✅ Sent to chain. Tx: {tx_hash}")
+            return True, tx_hash
         except Exception as e:
+            with _nonce_lock:
+                _next_nonce.pop(account_address, None)
             print(f"❌ Error sending transaction: {e}")
             return False, None
 
@@ -134,27 +199,47 @@ def save_to_blockchain(name, timestamp, web3=None, contract=None, account_addres
 
 
 # --------------------------------------
-# 6. Webcam Attendance Capture
+# 5. Webcam Attendance Capture
 # --------------------------------------
 def capture_and_log(send_to_chain=False, web3=None, contract=None, account_address=None, private_key=None):
-    cap = cv2.VideoCapture(0)
-    known_embeddings = load_all_embeddings()
+    cap = open_camera(0)
+    # reused for every frame; cap.read fills it in place
+    frame_buf = np.empty((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    known_names, known_matrix = load_all_embeddings()
+    warm_match_kernel(known_matrix)
     logged_today = set()
+    faces, ref_small = [], None
+    tracked = []
+    # fetched once here rather than on every send
+    chain_id = web3.eth.chain_id if send_to_chain else None
+    # sends go to a thread pool so the webcam loop never waits on the node
+    sender = ThreadPoolExecutor(max_workers=4) if send_to_chain else None
 
     print("\n🎥 Webcam started. Press Q to quit.\n")
 
     while True:
-        ret, frame = cap.read()
+        ret, frame = cap.read(frame_buf)
         if not ret:
             print("❌ Camera error.")
             break
 
-        faces = app.get(frame)
+        # static scene: reuse the last detections instead of running the model again
+        changed, small = frame_changed(frame, ref_small)
+        if changed:
+            faces = detect_faces(app, frame)
+            ref_small = small
 
+        # every face is recognized before anything is drawn: the aligned crop reaches past
+        # the bbox and would otherwise pick up a neighbour's box or label
+        names = []
         for face in faces:
-            emb = face.embedding.tolist()
-            name = match_face(emb, known_embeddings)
+            name = tracked_name(face.bbox, tracked)
+            if name is None:
+                name = match_face(embed_face(rec_model, frame, face), known_names, known_matrix)
+            names.append(name)
+        tracked = [(face.bbox, name) for face, name in zip(faces, names) if name]
 
+        for face, name in zip(faces, names):
             x1, y1, x2, y2 = map(int, face.bbox)
 
             if name:
@@ -163,12 +248,9 @@ def capture_and_log(send_to_chain=False, web3=None, contract=None, account_addre
                     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
                     if send_to_chain:
-                        success, tx_hash = save_to_blockchain(name, timestamp, web3=web3, contract=contract, account_address=account_address, private_key=private_key)
-                        if success:
-                            logged_today.add(name)
-                        else:
-                            # still add to logged_today to avoid reattempt spamming if needed — change behavior if you prefer
-                            logged_today.add(name)
+                        sender.submit(save_to_blockchain, name, timestamp, web3=web3, contract=contract, account_address=account_address, private_key=private_key, chain_id=chain_id)
+                        # added whatever the outcome, to avoid reattempt spamming — change behavior if you prefer
+                        logged_today.add(name)
                     else:
                         # Dry - just print
                         save_to_blockchain(name, timestamp)
@@ -192,22 +274,33 @@ def capture_and_log(send_to_chain=False, web3=None, contract=None, account_addre
 
     cap.release()
     cv2.destroyAllWindows()
+    if sender is not None:
+        # let sends that are still in flight finish
+        sender.shutdown(wait=True)
     print("\n🛑 Webcam stopped.")
 
 
 # --------------------------------------
 # MAIN
 # --------------------------------------
+@lru_cache(maxsize=None)
+def load_abi(abi_path):
+    return read_json(abi_path)
+
+
 def init_web3_and_contract(rpc_url, contract_address, abi_path, private_key, account_address):
     if Web3 is None or Account is None:
         raise ImportError("web3/eth-account are required to send to blockchain. Install with `pip install web3 eth-account`")
 
-    web3 = Web3(Web3.HTTPProvider(rpc_url))
+    # connection pool sized for the background send threads
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+    session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+    web3 = Web3(Web3.HTTPProvider(rpc_url, session=session))
     if not web3.is_connected():
         raise ConnectionError(f"Could not connect to RPC at {rpc_url}")
 
-    with open(abi_path, 'r') as f:
-        abi = json.load(f)
+    abi = load_abi(abi_path)
 
     contract = web3.eth.contract(address=Web3.to_checksum_address(contract_address), abi=abi)
     return web3, contract
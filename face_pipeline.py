@@ -0,0 +1,217 @@
+"""
+face_pipeline.py
+
+Face detection, recognition and matching helpers shared by app.py (Streamlit) and
+face_attendance.py (OpenCV window). Importing this module loads no models: call
+load_face_model() once the app is ready to pay for it.
+
+Matching works on an (N, D) float32 matrix of L2-normalized student embeddings (see
+stack_embeddings), so scoring a face against every student is one matrix-vector product.
+"""
+
+import hashlib
+import json
+import math
+
+import cv2
+import numpy as np
+from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+
+# optional faster JSON parser — falls back to the stdlib json module
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+# optional: call BLAS sgemv directly for large classes (skips NumPy's matmul dispatch)
+try:
+    from scipy.linalg.blas import sgemv
+except Exception:
+    sgemv = None
+
+# optional: JIT-compiled matcher (see _match) — without numba the BLAS/NumPy path is used
+try:
+    from numba import njit, prange
+except Exception:
+    njit = None
+
+
+def read_json(path):
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# --------------------------------------
+# Face model
+# --------------------------------------
+# Webcam faces fill a large part of the frame, so 320x320 detection is enough
+# (detector cost grows with the square of the input size).
+DET_SIZE = (320, 320)
+
+# ONNX Runtime already applies ORT_ENABLE_ALL graph optimizations by default; this only
+# stops the CPU memory arena from over-allocating as it grows.
+ORT_PROVIDER_OPTIONS = [{'arena_extend_strategy': 'kSameAsRequested'}]
+
+
+def load_face_model():
+    """Load the detection + recognition models; the webcam loops run them separately (see detect_faces)."""
+    model = FaceAnalysis(name='buffalo_l', allowed_modules=['detection', 'recognition'],
+                         providers=['CPUExecutionProvider'], provider_options=ORT_PROVIDER_OPTIONS)
+    model.prepare(ctx_id=0, det_size=DET_SIZE)
+    return model
+
+
+def detect_faces(model, frame):
+    """Run only the detection model; embeddings are computed later, for untracked faces."""
+    bboxes, kpss = model.det_model.detect(frame, max_num=0, metric='default')
+    return [
+        Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+        for i in range(bboxes.shape[0])
+    ]
+
+
+def embed_face(rec_model, frame, face):
+    """L2-normalized float32 embedding of a detected face, ready for best_match."""
+    emb = rec_model.get(frame, face).astype(np.float32, copy=False)
+    # plain dot + sqrt: np.linalg.norm's axis/ord handling costs more than the math here
+    emb *= 1.0 / math.sqrt(float(emb @ emb))
+    return emb
+
+
+# --------------------------------------
+# Matching
+# --------------------------------------
+def stack_embeddings(embeddings):
+    """Turn {name: embedding} into (names, M), M being an (N, D) float32 matrix of unit rows."""
+    names = list(embeddings)
+    if not names:
+        return names, np.empty((0, 0), dtype=np.float32)
+
+    M = np.stack([np.asarray(embeddings[n], dtype=np.float32) for n in names])
+    M /= np.linalg.norm(M, axis=1, keepdims=True)
+    return names, M
+
+
+SGEMV_MIN_STUDENTS = 100  # below this, M @ p is already as fast as calling BLAS directly
+# The numba kernel splits the rows across its thread pool, and waking the pool costs more
+# than BLAS needs for the whole product until the class is this large.
+MATCH_KERNEL_MIN_STUDENTS = 5000
+
+
+# optional JIT kernel: scores every student and picks the best in one compiled call
+_match = None
+if njit is not None:
+    @njit(cache=True, fastmath=True, parallel=True)
+    def _match(M, p):
+        """Return (row, score) of the row of M with the largest dot product with p."""
+        n = M.shape[0]
+        scores = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            s = np.float32(0.0)
+            for k in range(M.shape[1]):
+                s += M[i, k] * p[k]
+            scores[i] = s
+        # argmax stays serial: a shared running best inside prange would race
+        best = 0
+        for i in range(1, n):
+            if scores[i] > scores[best]:
+                best = i
+        return best, scores[best]
+
+
+def warm_match_kernel(known_matrix):
+    # compile (or load from numba's on-disk cache) up front, not on the first face, and only
+    # when best_match will actually use the kernel for this class
+    if _match is not None and known_matrix.shape[0] >= MATCH_KERNEL_MIN_STUDENTS:
+        _match(known_matrix[:1], known_matrix[0])
+
+
+def best_match(known_matrix, p):
+    """Return (row, score) of the student closest to the normalized embedding p (N must be > 0)."""
+    if _match is not None and known_matrix.shape[0] >= MATCH_KERNEL_MIN_STUDENTS:
+        i, score = _match(known_matrix, p)
+        return int(i), float(score)
+
+    # cosine similarity against every student at once (rows of known_matrix are unit length)
+    if sgemv is not None and known_matrix.shape[0] >= SGEMV_MIN_STUDENTS:
+        # known_matrix.T is Fortran-ordered, so BLAS takes it without a copy
+        sims = sgemv(1.0, known_matrix.T, p, trans=1)
+    else:
+        sims = known_matrix @ p
+    i = int(sims.argmax())
+    return i, float(sims[i])
+
+
+# --------------------------------------
+# Attendance transactions
+# --------------------------------------
+# Fixed gas limit for logAttendance instead of an estimate_gas round-trip per entry.
+# A typical entry (three new storage slots plus the AttendanceLogged event) stays well
+# under it; the rest is headroom for long names. Unused gas is refunded, not charged.
+LOG_ATTENDANCE_GAS = 250_000
+
+
+def attendance_digest(name, timestamp):
+    # raw 32 bytes for the contract's bytes32 hash; .hex() gives the string shown to users
+    return hashlib.sha256(f"{name}-{timestamp}".encode()).digest()
+
+
+# --------------------------------------
+# Webcam
+# --------------------------------------
+# Motion gate: detection is skipped while a small grayscale copy of the frame stays
+# within MOTION_THRESHOLD (mean absolute difference, 0-255) of the last detected frame.
+MOTION_SIZE = (80, 60)
+MOTION_THRESHOLD = 3.0
+
+
+def frame_changed(frame, ref_small):
+    """Return (changed, small): small is the downscaled gray frame to use as the next reference."""
+    small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), MOTION_SIZE, interpolation=cv2.INTER_AREA)
+    changed = ref_small is None or cv2.absdiff(small, ref_small).mean() >= MOTION_THRESHOLD
+    return changed, small
+
+
+# Tracking: a detection overlapping a face recognized in the previous frame by more
+# than TRACK_IOU keeps that name, so the recognition model only runs on new faces.
+TRACK_IOU = 0.5
+
+
+def bbox_iou(a, b):
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+def tracked_name(bbox, tracked):
+    """Name of the tracked (bbox, name) that best overlaps bbox above TRACK_IOU, else None."""
+    best_name, best_iou = None, TRACK_IOU
+    for prev_bbox, name in tracked:
+        overlap = bbox_iou(bbox, prev_bbox)
+        if overlap > best_iou:
+            best_name, best_iou = name, overlap
+    return best_name
+
+
+FRAME_WIDTH, FRAME_HEIGHT = 640, 480
+
+
+def open_camera(index=0):
+    """Open the webcam as 640x480 MJPG with a one-frame driver buffer.
+
+    MJPG keeps USB bandwidth low at this size, and the short buffer means each read
+    returns a fresh frame instead of a queued, stale one.
+    """
+    cap = cv2.VideoCapture(index)
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
@@ -0,0 +1,60 @@
+"""
+timestamp_kernels.py
+
+numba kernels for Get_Attendance_By_Time.py: parse 'YYYY-MM-DD HH:MM:SS' timestamps packed
+as (N, 19) uint8 rows and range-check them in parallel. Importing this module imports numba,
+so the query script only does it for large result sets (see JIT_MIN_ROWS there).
+"""
+
+from numba import njit, prange
+
+
+@njit(cache=True)
+def ts_digits(row, start, count):
+    value = 0
+    for k in range(start, start + count):
+        c = int(row[k]) - 48
+        if c < 0 or c > 9:
+            return -1
+        value = value * 10 + c
+    return value
+
+
+@njit(cache=True)
+def days_in_month(year, month):
+    if month == 2:
+        return 29 if (year % 4 == 0 and year % 100 != 0) or year % 400 == 0 else 28
+    return 30 if month == 4 or month == 6 or month == 9 or month == 11 else 31
+
+
+@njit(cache=True, parallel=True)
+def filter_ts(buf, start_s, end_s, out_mask):
+    """Parse each (19,) uint8 row as 'YYYY-MM-DD HH:MM:SS' and range-check it.
+
+    out_mask[i] is 1 if start_s <= t <= end_s, 0 if outside, -1 if the row isn't a valid timestamp.
+    """
+    for i in prange(buf.shape[0]):
+        row = buf[i]
+        year = ts_digits(row, 0, 4)
+        month = ts_digits(row, 5, 2)
+        day = ts_digits(row, 8, 2)
+        hour = ts_digits(row, 11, 2)
+        minute = ts_digits(row, 14, 2)
+        second = ts_digits(row, 17, 2)
+        if (row[4] != 45 or row[7] != 45 or row[10] != 32 or row[13] != 58 or row[16] != 58
+                or year < 1 or month < 1 or month > 12 or hour < 0 or hour > 23
+                or minute < 0 or minute > 59 or second < 0 or second > 59
+                or day < 1 or day > days_in_month(year, month)):
+            out_mask[i] = -1
+            continue
+
+        # days since 1970-01-01 from the civil date (proleptic Gregorian)
+        y = year - 1 if month <= 2 else year
+        era = y // 400
+        yoe = y - era * 400
+        doy = (153 * (month + 9 if month <= 2 else month - 3) + 2) // 5 + day - 1
+        doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+        days = era * 146097 + doe - 719468
+
+        t = days * 86400 + hour * 3600 + minute * 60 + second
+        out_mask[i] = 1 if start_s <= t <= end_s else 0